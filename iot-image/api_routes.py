@@ -1,62 +1,207 @@
 # api_routes.py
+import asyncio
+import hashlib
 import logging
+import os
+import shutil
 import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import (APIRouter, File, Form, HTTPException, Request,
-                     UploadFile)
-from fastapi.responses import JSONResponse
+import orjson
+from fastapi import (APIRouter, File, Form, HTTPException,
+                     Request, Response, UploadFile)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
 
-from config import DATA_DIR, PERMITTED_FACES_DIR, face_recognition_available
-from data_store import data_store
+from config import (DATA_DIR, MAX_UPLOAD_BYTES, PERMITTED_FACES_DIR,
+                    RECOGNIZE_BATCH_MAX_FILES, face_recognition_available)
+from data_store import data_store, now_ms
 from log_utils import log_function_call, setup_logger
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/v1")
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+DEVICES_CACHE_TTL = 1.0  # Seconds a serialized /devices payload is reused
+_response_cache: Dict[str, Tuple[int, float, bytes, str]] = {}  # key -> (data version, built at, payload, ETag)
+
+# Leading magic bytes of the image formats load_permitted_faces can read
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+)
+
+
+# Code points below this (Latin, Greek, Cyrillic, ...) are memoized by _SafeNameTable: at most 2048 entries
+SAFE_NAME_MEMO_LIMIT = 0x800
+
+
+class _SafeNameTable(dict):
+    """
+    str.translate table keeping alphanumerics, space, '.' and '_' and dropping everything else.
+    ASCII is filled in up front; other code points are classified on lookup and only memoized
+    below SAFE_NAME_MEMO_LIMIT, so names from clients cannot grow the table without bound.
+    """
+    def __init__(self):
+        super().__init__((codepoint, self._classify(codepoint)) for codepoint in range(128))
+
+    @staticmethod
+    def _classify(codepoint: int) -> Optional[str]:
+        char = chr(codepoint)
+        return char if char.isalnum() or char in " ._" else None
+
+    def __missing__(self, codepoint: int) -> Optional[str]:
+        allowed = self._classify(codepoint)
+        if codepoint < SAFE_NAME_MEMO_LIMIT:
+            self[codepoint] = allowed
+        return allowed
+
+
+_SAFE_NAME_TABLE = _SafeNameTable()
+
+
+def _sniff_image_extension(header: bytes) -> Optional[str]:
+    """
+    Identify the image type from its first bytes without decoding it.
+    """
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return None
+
+
+def _client_key(request: Request, device_id: Optional[str] = None) -> str:
+    """
+    Identify the sending camera for per-client frame caching: its device id when it sent one,
+    otherwise its address.
+    """
+    if device_id and device_id != "unknown":
+        return f"device:{device_id}"
+    return f"client:{request.client.host if request.client else 'unknown'}"
+
+
+def _read_spooled_upload(upload: UploadFile) -> bytearray:
+    """
+    Read a spooled upload into an exactly sized bytearray in one pass, so numpy can alias it
+    without another copy. The size comes from the spooled file, so oversized uploads are
+    rejected before anything is read.
+    """
+    file = upload.file
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes.")
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < size:
+        count = file.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    view.release()
+    if filled < size:
+        del buffer[filled:]
+    return buffer
+
+
+async def _read_upload(upload: UploadFile) -> bytearray:
+    """
+    Read an upload off the event loop with a single threadpool hop (the spooled file may be on disk).
+    """
+    return await run_in_threadpool(_read_spooled_upload, upload)
+
+
+def _copy_spooled_upload(upload: UploadFile, destination: Path) -> int:
+    """
+    Copy a spooled upload to disk in UPLOAD_CHUNK_SIZE blocks, so memory stays flat whatever the upload size.
+    """
+    file = upload.file
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes.")
+    try:
+        with open(destination, "wb") as f:
+            shutil.copyfileobj(file, f, UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        destination.unlink(missing_ok=True)
+        raise
+    return size
+
+
+async def _save_upload(upload: UploadFile, destination: Path) -> int:
+    """
+    Stream an upload to disk without buffering it in memory, in a single threadpool hop.
+    """
+    return await run_in_threadpool(_copy_spooled_upload, upload, destination)
+
+
+class DeviceRegistration(BaseModel):
+    deviceId: str
+    deviceName: str
+
 
 @router.post("/devices/register")
 @log_function_call
-async def register_device_endpoint(deviceId: str = Form(...), deviceName: str = Form(...)):
+async def register_device_endpoint(request: Request):
+    """
+    Register a device from a JSON body ({"deviceId": ..., "deviceName": ...}), which skips multipart
+    parsing entirely; form-encoded registrations from existing clients are still accepted.
+    """
     try:
-        device_data = {'id': deviceId, 'name': deviceName, 'status': 'online'}
+        if request.headers.get("content-type", "").startswith("application/json"):
+            payload = orjson.loads(await request.body())
+            if not isinstance(payload, dict):
+                raise ValueError("Expected a JSON object.")
+        else:
+            payload = dict(await request.form())
+        registration = DeviceRegistration(**payload)
+        device_data = {'id': registration.deviceId, 'name': registration.deviceName, 'status': 'online'}
         registered_device = data_store.register_device(device_data)
-        return JSONResponse(content={"success": True, "device": registered_device})
+        return ORJSONResponse(content={"success": True, "device": registered_device})
+    except ValidationError as e:
+        # Missing or mistyped fields keep FastAPI's usual 422 response
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/stream/stream")
 @log_function_call
-async def stream_endpoint(image: UploadFile = File(...), deviceId: Optional[str] = Form("unknown")):
+async def stream_endpoint(request: Request, image: UploadFile = File(...), deviceId: Optional[str] = Form("unknown")):
     """
     High-speed streaming endpoint for ESP32-CAM integration.
     """
-    contents = await image.read()
+    contents = await _read_upload(image)
     if not contents:
         raise HTTPException(status_code=400, detail="Empty image file.")
     
-    # Register/update device quickly
-    device_data = {'id': deviceId, 'name': f'Device-{deviceId}', 'status': 'online'}
-    data_store.register_device(device_data)
+    # Mark the device online (registers it on its first frame)
+    data_store.touch_device(deviceId)
     
     # Perform recognition asynchronously
-    result = await data_store.perform_face_recognition(contents)
+    result = await data_store.perform_face_recognition(contents, _client_key(request, deviceId))
     result["deviceId"] = deviceId
     
     # Broadcast to WebSocket clients
     from main import manager
+    timestamp = now_ms()
     await manager.broadcast({
         "type": "new_frame",
         "deviceId": deviceId,
-        "timestamp": int(time.time() * 1000),
-        "filename": f"{deviceId}_{int(time.time() * 1000)}.jpg",
+        "timestamp": timestamp,
+        "filename": f"{deviceId}_{timestamp}.jpg",
         "url": "/data/frame.jpg",
         "recognition": result
     })
     
-    return JSONResponse(content=result)
+    return ORJSONResponse(content=result)
 
 
 @router.post("/recognition/add-permitted-face")
@@ -65,47 +210,103 @@ async def add_permitted_face(image: UploadFile = File(...), name: str = Form(...
     if not face_recognition_available:
         raise HTTPException(status_code=501, detail="Face recognition feature not available.")
 
-    safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '.', '_')).rstrip()
+    safe_name = name.translate(_SAFE_NAME_TABLE).rstrip()
     if not safe_name:
         raise HTTPException(status_code=400, detail="Invalid name provided.")
         
-    extension = Path(image.filename).suffix or ".jpg"
+    extension = _sniff_image_extension(await image.read(16))
+    if extension is None:
+        raise HTTPException(status_code=400, detail="Unsupported image format. Upload a JPEG or PNG.")
     file_path = PERMITTED_FACES_DIR / f"{safe_name}{extension}"
     
-    contents = await image.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    if not await _save_upload(image, file_path):
+        file_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Empty image file.")
     
-    logger.info(f"Saved new permitted face '{name}' to {file_path}")
-    data_store.load_permitted_faces() # Reload faces
+    logger.info("Saved new permitted face '%s' to %s", name, file_path)
+    # Encode only the new face, on the identification thread that owns the models. The encode
+    # validates the upload, so a rejected image is deleted and reported instead of accepted
+    added = await asyncio.get_running_loop().run_in_executor(
+        data_store.identification_executor,
+        data_store.add_permitted_face_incremental, file_path, safe_name, True
+    )
+    if not added:
+        raise HTTPException(status_code=400, detail="No face could be found in the uploaded image.")
     
-    return JSONResponse(content={"success": True, "message": f"Permitted face '{name}' added."})
+    return ORJSONResponse(content={"success": True, "message": f"Permitted face '{name}' added."})
 
 @router.post("/recognize")
 @log_function_call
-async def recognize_endpoint(image: UploadFile = File(...)):
+async def recognize_endpoint(request: Request, image: UploadFile = File(...)):
     """
     Optimized endpoint for high-speed face recognition from the backend.
     """
-    start_time = time.time()
+    start_ns = time.monotonic_ns()
     
-    contents = await image.read()
+    contents = await _read_upload(image)
     if not contents:
         raise HTTPException(status_code=400, detail="Uploaded file is empty.")
 
     # Perform the recognition (now optimized for speed)
-    result = await data_store.perform_face_recognition(contents)
+    result = await data_store.perform_face_recognition(contents, _client_key(request))
     
     # Add processing time to the response
-    processing_time = time.time() - start_time
+    processing_time = (time.monotonic_ns() - start_ns) / 1e9
     result["total_processing_time"] = round(processing_time, 4)
     
-    return JSONResponse(content=result)
+    return ORJSONResponse(content=result)
+
+@router.post("/recognize/batch")
+@log_function_call
+async def recognize_batch_endpoint(request: Request, images: List[UploadFile] = File(...)):
+    """
+    Recognize several frames posted in one multipart request (repeated "images" fields).
+    Clients sending more than one frame at a time should prefer this over repeated /recognize calls;
+    the frames are queued together so they land in the same recognition batch.
+    """
+    start_ns = time.monotonic_ns()
+    if len(images) > RECOGNIZE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {RECOGNIZE_BATCH_MAX_FILES} images per request.")
+
+    contents = await asyncio.gather(*(_read_upload(image) for image in images))
+    if not all(contents):
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+
+    client_key = _client_key(request)
+    results = await asyncio.gather(
+        *(data_store.perform_face_recognition(image_bytes, client_key) for image_bytes in contents)
+    )
+
+    processing_time = (time.monotonic_ns() - start_ns) / 1e9
+    return ORJSONResponse(content={
+        "results": results,
+        "count": len(results),
+        "total_processing_time": round(processing_time, 4)
+    })
 
 @router.get("/devices")
-async def get_all_devices_endpoint():
-    devices_list = data_store.get_all_devices()
-    return JSONResponse(content={"success": True, "devices": devices_list})
+async def get_all_devices_endpoint(request: Request):
+    # Dashboards poll this endpoint; reuse the serialized payload for DEVICES_CACHE_TTL seconds,
+    # unless a device was registered since (lastSeen refreshes alone can wait for the TTL)
+    now = time.monotonic()
+    version = data_store.devices_version
+    cached = _response_cache.get("devices")
+    if cached is None or cached[0] != version or now - cached[1] > DEVICES_CACHE_TTL:
+        devices_list = data_store.get_all_devices()
+        payload = orjson.dumps({
+            "success": True,
+            "devices": devices_list,
+            "online": data_store.count_online_devices()
+        })
+        etag = f'"{hashlib.blake2b(payload, digest_size=8).hexdigest()}"'
+        cached = (version, now, payload, etag)
+        _response_cache["devices"] = cached
+
+    # Pollers that already hold this payload get a bodiless 304
+    headers = {"ETag": cached[3], "Cache-Control": f"max-age={int(DEVICES_CACHE_TTL)}"}
+    if request.headers.get("if-none-match") == cached[3]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached[2], media_type="application/json", headers=headers)
 
 # A simple root endpoint for the router
 @router.get("/")
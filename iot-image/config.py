@@ -1,6 +1,9 @@
 # config.py
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 from pathlib import Path
 
@@ -17,7 +20,54 @@ UVICORN_LOG_LEVEL = os.getenv('UVICORN_LOG_LEVEL', 'warning').lower()  # Reduced
 
 # Performance optimizations
 MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))
+# Uvicorn worker processes. Keep at 1 when recognition runs on the GPU; raise it
+# for the CPU (HOG) fallback so each core gets its own worker.
+WORKERS = max(1, int(os.getenv('WORKERS', '1')))
+# Connection handling: listen backlog, idle keep-alive, and a cap on concurrent connections
+# (excess requests get a 503 instead of queueing unbounded behind the recognizer)
+UVICORN_BACKLOG = int(os.getenv('UVICORN_BACKLOG', '2048'))
+UVICORN_TIMEOUT_KEEP_ALIVE = int(os.getenv('UVICORN_TIMEOUT_KEEP_ALIVE', '30'))
+UVICORN_LIMIT_CONCURRENCY = int(os.getenv('UVICORN_LIMIT_CONCURRENCY', '256')) or None
+# Restart a worker after this many requests (0 disables; uvicorn exits rather than restarts a single worker)
+UVICORN_LIMIT_MAX_REQUESTS = int(os.getenv('UVICORN_LIMIT_MAX_REQUESTS', '0')) or None
 FACE_RECOGNITION_TIMEOUT = float(os.getenv('FACE_RECOGNITION_TIMEOUT', '3.0'))  # Fast timeout
+# Send WebSocket broadcasts as binary frames (pre-encoded JSON bytes) instead of text frames
+WEBSOCKET_BINARY_FRAMES = os.getenv('WEBSOCKET_BINARY_FRAMES', 'False').lower() == 'true'
+# GPU used by dlib when it is built with CUDA
+CUDA_DEVICE = int(os.getenv('CUDA_DEVICE', '0'))
+# Recognition micro-batching: requests arriving within BATCH_WINDOW_MS are processed together
+BATCH_SIZE = max(1, int(os.getenv('BATCH_SIZE', '8')))
+BATCH_WINDOW_MS = float(os.getenv('BATCH_WINDOW_MS', '10'))
+# Recognitions allowed in flight at once; further requests wait instead of piling decoded frames into memory
+MAX_INFLIGHT_RECOGNITIONS = max(1, int(os.getenv('MAX_INFLIGHT_RECOGNITIONS', '32')))
+# Seconds a recognition result is reused for byte-identical uploads (0 disables)
+FRAME_CACHE_TTL = float(os.getenv('FRAME_CACHE_TTL', '2.0'))
+# Seconds a client's "no face"/"unknown face" result is reused for frames with the same perceptual hash.
+# Off by default: a coarse whole-frame hash barely changes when a different person stands in the same spot,
+# so permitted-face decisions are never reused this way
+FRAME_HASH_CACHE_TTL = float(os.getenv('FRAME_HASH_CACHE_TTL', '0'))
+# Largest accepted image upload; bigger requests are rejected with 413 before being read
+MAX_UPLOAD_MB = float(os.getenv('MAX_UPLOAD_MB', '10'))
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+# Whole request body limit: the upload plus headroom for multipart boundaries and form fields
+MAX_REQUEST_BODY_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+# /recognize/batch takes up to this many frames, each up to MAX_UPLOAD_BYTES, so its body limit scales with it
+RECOGNIZE_BATCH_MAX_FILES = 16
+MAX_BATCH_REQUEST_BODY_BYTES = RECOGNIZE_BATCH_MAX_FILES * MAX_UPLOAD_BYTES + 64 * 1024
+# Decode JPEG frames at 1/N resolution (1, 2, 4 or 8); libjpeg-turbo scales during the IDCT at no extra cost
+IMAGE_DECODE_REDUCTION = int(os.getenv('IMAGE_DECODE_REDUCTION', '1'))
+if IMAGE_DECODE_REDUCTION not in (1, 2, 4, 8):
+    IMAGE_DECODE_REDUCTION = 1
+# Decode JPEG frames on the GPU with nvJPEG (torchvision) instead of the CPU; torch is only imported when enabled
+GPU_JPEG_DECODE = os.getenv('GPU_JPEG_DECODE', 'False').lower() == 'true'
+# Faces smaller than MIN_FACE_SIZE x MIN_FACE_SIZE pixels are too small to match reliably and are not encoded
+MIN_FACE_SIZE = int(os.getenv('MIN_FACE_SIZE', '64'))
+# HOG detection runs on a copy downscaled to at most this many pixels on its longest side (0 disables);
+# boxes are mapped back so encodings still use the full-resolution frame
+DETECTION_MAX_DIMENSION = int(os.getenv('DETECTION_MAX_DIMENSION', '480'))
+# HOG upsampling passes over the detection copy: 1 finds faces down to ~40px there, 0 skips the 2x upsample
+# (about 4x less HOG work) but needs faces of ~80px in the detection copy
+HOG_UPSAMPLE = max(0, int(os.getenv('HOG_UPSAMPLE', '1')))
 
 # --- Logging Configuration ---
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -33,7 +83,9 @@ else:  # standard format
     date_format = "%Y-%m-%d %H:%M:%S"
 
 # Configure handlers
-log_handlers = [logging.StreamHandler(sys.stdout)]
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter(log_format, date_format))
+log_handlers = [console_handler]
 
 # Add file handler if LOG_FILE is specified
 if LOG_FILE:
@@ -44,14 +96,29 @@ if LOG_FILE:
     file_handler.setFormatter(logging.Formatter(log_format, date_format))
     log_handlers.append(file_handler)
 
-# Configure logging
+# Configure logging. Callers only enqueue records; a listener thread does the formatting and
+# the console/file I/O, so a slow terminal or disk never stalls request handling
+log_queue = queue.SimpleQueue()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+# The message (and any traceback) is rendered before enqueueing; the full line format is applied by the listener
+queue_handler.setFormatter(logging.Formatter("%(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=LOG_LEVEL,
-    format=log_format,
-    datefmt=date_format,
-    handlers=log_handlers
+    handlers=[queue_handler]
 )
 
+# Request logs: box-drawn banners for a person at a terminal, or one JSON line per request for log shippers.
+# "auto" uses banners only when stdout is a TTY and LOG_FORMAT is not json
+REQUEST_LOG_PRETTY = os.getenv("REQUEST_LOG_PRETTY", "auto").lower()
+if REQUEST_LOG_PRETTY == "auto":
+    REQUEST_LOG_PRETTY = LOG_FORMAT != "json" and sys.stdout.isatty()
+else:
+    REQUEST_LOG_PRETTY = REQUEST_LOG_PRETTY == "true"
+
 # Reduce verbosity of some loggers
 logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
@@ -65,6 +132,8 @@ BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "data"
 RECORDINGS_DIR = BASE_DIR / "recordings"
 PERMITTED_FACES_DIR = BASE_DIR / "permitted_faces"
+# Face encodings keyed by file mtime/size so unchanged images are not re-encoded
+PERMITTED_FACES_CACHE = PERMITTED_FACES_DIR / ".encodings.npz"
 
 # Create directories on startup
 for directory in [DATA_DIR, RECORDINGS_DIR, PERMITTED_FACES_DIR]:
@@ -101,6 +170,64 @@ except ImportError:
     face_recognition = None
     face_recognition_available = False
     
+try:
+    import dlib
+    dlib_cuda_available = bool(getattr(dlib, "DLIB_USE_CUDA", False))
+except ImportError:
+    dlib = None
+    dlib_cuda_available = False
+
+try:
+    from turbojpeg import TJPF_RGB, TurboJPEG
+    turbojpeg = TurboJPEG()  # Raises if the libturbojpeg shared library cannot be found
+    turbojpeg_available = True
+except (ImportError, OSError, RuntimeError):
+    TJPF_RGB = None
+    turbojpeg = None
+    turbojpeg_available = False
+
+try:
+    import numba
+    numba_available = True
+except ImportError:
+    numba = None
+    numba_available = False
+
+try:
+    import mediapipe as mp
+    mediapipe_available = True
+except ImportError:
+    mp = None
+    mediapipe_available = False
+
+torch = None
+decode_jpeg = None
+ImageReadMode = None
+gpu_jpeg_available = False
+if GPU_JPEG_DECODE:
+    try:
+        import torch
+        from torchvision.io import ImageReadMode, decode_jpeg
+        gpu_jpeg_available = torch.cuda.is_available()
+    except ImportError:
+        torch = None
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    watchdog_available = True
+except ImportError:
+    FileSystemEventHandler = None
+    Observer = None
+    watchdog_available = False
+
+try:
+    import faiss
+    faiss_available = True
+except ImportError:
+    faiss = None
+    faiss_available = False
+
 try:
     import uvicorn
     uvicorn_available = True
@@ -108,7 +235,38 @@ except ImportError:
     uvicorn = None
     uvicorn_available = False
 
+try:
+    import uvloop  # noqa: F401
+    uvloop_available = True
+except ImportError:
+    uvloop_available = False
+
+try:
+    import httptools  # noqa: F401
+    httptools_available = True
+except ImportError:
+    httptools_available = False
+
+# Face detector for recognition frames: "mediapipe" (BlazeFace, much faster on CPU) or "hog" (dlib)
+FACE_DETECTOR = os.getenv('FACE_DETECTOR', 'mediapipe' if mediapipe_available else 'hog').lower()
+if FACE_DETECTOR not in ('mediapipe', 'hog') or (FACE_DETECTOR == 'mediapipe' and not mediapipe_available):
+    FACE_DETECTOR = 'hog'
+
+# Prefer the libuv event loop and the C HTTP parser, falling back to the pure-Python defaults
+UVICORN_LOOP = "uvloop" if uvloop_available else "asyncio"
+UVICORN_HTTP = "httptools" if httptools_available else "h11"
+
 logger.info(f"Logging initialized with level: {LOG_LEVEL}")
 logger.info(f"OpenCV (cv2) available: {cv2_available}")
 logger.info(f"NumPy (np) available: {numpy_available}")
-logger.info(f"face_recognition available: {face_recognition_available}")
\ No newline at end of file
+logger.info(f"face_recognition available: {face_recognition_available}")
+logger.info(f"dlib CUDA available: {dlib_cuda_available}")
+logger.info(f"TurboJPEG available: {turbojpeg_available}")
+if GPU_JPEG_DECODE:
+    logger.info(f"GPU (nvJPEG) decode available: {gpu_jpeg_available}")
+logger.info(f"MediaPipe available: {mediapipe_available}")
+logger.info(f"FAISS available: {faiss_available}")
+logger.info(f"Numba available: {numba_available}")
+logger.info(f"watchdog available: {watchdog_available}")
+logger.info(f"Face detector: {FACE_DETECTOR}")
+logger.info(f"Uvicorn loop: {UVICORN_LOOP}, HTTP parser: {UVICORN_HTTP}")
\ No newline at end of file
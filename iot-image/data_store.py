@@ -1,144 +1,784 @@
 # data_store.py
+import asyncio
+import hashlib
 import logging
+import os
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 # Import dependencies and config variables from the config module
-from config import (PERMITTED_FACES_DIR, cv2, cv2_available,
-                    face_recognition, face_recognition_available, np,
-                    numpy_available)
+from config import (BATCH_SIZE, BATCH_WINDOW_MS, CUDA_DEVICE,
+                    DETECTION_MAX_DIMENSION, FACE_DETECTOR, FRAME_CACHE_TTL,
+                    FRAME_HASH_CACHE_TTL,
+                    HOG_UPSAMPLE,
+                    IMAGE_DECODE_REDUCTION, MAX_INFLIGHT_RECOGNITIONS, MIN_FACE_SIZE,
+                    PERMITTED_FACES_CACHE, PERMITTED_FACES_DIR, TJPF_RGB,
+                    ImageReadMode, cv2, cv2_available, decode_jpeg, dlib,
+                    dlib_cuda_available, faiss, faiss_available, face_recognition,
+                    face_recognition_available, gpu_jpeg_available, mp, np, numba,
+                    numba_available, numpy_available,
+                    torch, turbojpeg, turbojpeg_available)
+from recognition_batcher import RecognitionBatcher
+from starlette.concurrency import run_in_threadpool
 
 logger = logging.getLogger(__name__)
 
+# Image types picked up from PERMITTED_FACES_DIR (matched case-insensitively)
+PERMITTED_IMAGE_SUFFIXES = frozenset({"jpg", "jpeg", "png"})
+
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+# Contrast/brightness boost applied to recognition frames (cv2.convertScaleAbs alpha/beta)
+CONTRAST_ALPHA = 1.2
+CONTRAST_BETA = 40
+
+# Recent per-client frame hashes kept for duplicate suppression
+FRAME_CACHE_SIZE = 512
+
+# Device statuses counted as online
+ONLINE_STATUSES = frozenset({"online", "warning"})
+
+# OpenCV >= 4.10 can decode straight to RGB, which lets us skip the BGR->RGB pass entirely
+IMREAD_COLOR_RGB = getattr(cv2, "IMREAD_COLOR_RGB", None) if cv2_available else None
+
+# OpenCV's counterpart to TurboJPEG scaling: JPEG is decoded at 1/N resolution inside libjpeg
+IMREAD_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+} if cv2_available else {}
+
+def now_ms() -> int:
+    """Wall-clock time in integer epoch milliseconds (no float round-trip)."""
+    return time.time_ns() // 1_000_000
+
+# Below this gallery size the vectorized numpy pass beats the JIT kernel's thread fan-out
+NUMBA_MIN_GALLERY_SIZE = 256
+
+
+def _numpy_uses_optimized_blas() -> bool:
+    """True when numpy links an optimized BLAS (OpenBLAS, MKL, Accelerate, ...) rather than the reference one."""
+    try:
+        blas = np.show_config(mode="dicts")["Build Dependencies"]["blas"]
+    except Exception:
+        # numpy < 1.26 cannot report its build; its wheels have bundled OpenBLAS for years
+        return True
+    return bool(blas.get("found")) and blas.get("name", "").lower() not in ("", "blas", "cblas", "none")
+
+
+if numba_available:
+    # Without an optimized BLAS (e.g. distro numpy on edge boards) the JIT kernel wins at any gallery size
+    NUMPY_HAS_FAST_BLAS = _numpy_uses_optimized_blas()
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _nearest_encoding(known, query):
+        """Index and euclidean distance of the row of `known` closest to `query`."""
+        count = known.shape[0]
+        squared_distances = np.empty(count)
+        for i in numba.prange(count):
+            total = 0.0
+            for k in range(known.shape[1]):
+                diff = known[i, k] - query[k]
+                total += diff * diff
+            squared_distances[i] = total
+        best = 0
+        for i in range(1, count):
+            if squared_distances[i] < squared_distances[best]:
+                best = i
+        return best, np.sqrt(squared_distances[best])
+
+
+@dataclass
+class Device:
+    """A registered camera. Slotted to keep per-device memory small; orjson serializes it directly."""
+    __slots__ = ("id", "name", "status", "lastSeen")
+    id: str
+    name: str
+    status: str
+    lastSeen: int
+
+
 class DataStore:
     def __init__(self):
-        self.devices: Dict[str, Dict[str, Any]] = {}
+        self.devices: Dict[str, Device] = {}
+        # Bumped whenever a device is registered or its details change, so cached listings can be invalidated
+        self.devices_version = 0
+        # Devices currently reporting as online/warning, kept in step with the records so counts need no scan
+        self.online_device_ids: set = set()
         self.permitted_face_encodings: List[Any] = []
+        # Contiguous float32 (N, 128) copy of permitted_face_encodings and its squared row norms, for matching
+        self.known_encodings = None
+        self.known_sq_norms = None
         self.permitted_face_names: List[str] = []
+        self.permitted_face_files: List[str] = []
+        self.encoding_cache: Dict[str, Tuple[int, int, Any]] = {}
+        self.face_index = None
+        # MediaPipe detector, created on the identification thread (the graph is not thread-safe)
+        self.face_detector = None
+        # Guards the permitted-face state: recognition and enrollment run on worker threads
+        self.faces_lock = threading.RLock()
+        self.pending_recognitions: Dict[bytes, asyncio.Future] = {}
+        # Recent results as key -> (stored at, gallery version, result); LRUs only touched from the event loop.
+        # exact_frame_cache is keyed by the upload's digest, frame_cache by (client, perceptual hash)
+        self.exact_frame_cache: "OrderedDict[bytes, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self.frame_cache: "OrderedDict[Tuple[str, bytes], Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self.gallery_version = 0
+        # Bounds decoded frames held in memory when requests arrive faster than they are identified
+        self.recognition_slots = asyncio.Semaphore(MAX_INFLIGHT_RECOGNITIONS)
+        # Identification stage: one thread owns the face models (and the GPU when dlib uses CUDA)
+        self.identification_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="identification")
+        self.recognition_batcher = RecognitionBatcher(
+            self.recognize_batch, BATCH_SIZE, BATCH_WINDOW_MS, executor=self.identification_executor
+        )
         logger.info("DataStore initialized.")
 
+    def _build_face_index(self):
+        """
+        Stack the permitted encodings into one (N, 128) array and, when FAISS is installed,
+        build an exact L2 index over them (GPU-backed when possible).
+        """
+        self.face_index = None
+        self.known_encodings = None
+        self.known_sq_norms = None
+        # Invalidates frame-cache results matched against the previous gallery
+        self.gallery_version += 1
+        if not self.permitted_face_encodings:
+            return
+
+        # float32 halves the bytes streamed per comparison; the precision loss is far below the match threshold
+        self.known_encodings = np.ascontiguousarray(self.permitted_face_encodings, dtype=np.float32).reshape(-1, 128)
+        self.known_sq_norms = np.einsum("ij,ij->i", self.known_encodings, self.known_encodings)
+        if not faiss_available:
+            return
+
+        index = faiss.IndexFlatL2(self.known_encodings.shape[1])
+        index.add(self.known_encodings)
+        if hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0:
+            index = faiss.index_cpu_to_gpu(faiss.StandardGpuResources(), 0, index)
+        self.face_index = index
+        logger.info("Built FAISS index with %d permitted faces", index.ntotal)
+
+    def _find_best_match(self, face_encoding) -> Tuple[int, float]:
+        """Return the index and euclidean distance of the closest permitted face."""
+        if self.face_index is not None:
+            query = np.ascontiguousarray(face_encoding, dtype=np.float32).reshape(1, -1)
+            squared_distances, indices = self.face_index.search(query, 1)
+            return int(indices[0][0]), float(np.sqrt(squared_distances[0][0]))
+
+        query = np.ascontiguousarray(face_encoding, dtype=np.float32)
+        if numba_available and (not NUMPY_HAS_FAST_BLAS or len(self.known_encodings) >= NUMBA_MIN_GALLERY_SIZE):
+            best_match_index, distance = _nearest_encoding(self.known_encodings, query)
+            return int(best_match_index), float(distance)
+
+        # ||k - q||^2 = ||k||^2 + ||q||^2 - 2 k.q: one BLAS matrix-vector product, no (N, 128) temporary,
+        # and only the winning distance needs a sqrt
+        squared_distances = self.known_sq_norms - 2.0 * (self.known_encodings @ query) + query.dot(query)
+        best_match_index = int(np.argmin(squared_distances))
+        return best_match_index, float(np.sqrt(max(squared_distances[best_match_index], 0.0)))
+
+    def _load_encoding_cache(self) -> Dict[str, Tuple[int, int, Any]]:
+        """Read the on-disk encoding cache as {filename: (mtime_ns, size, encoding)}."""
+        if not PERMITTED_FACES_CACHE.exists():
+            return {}
+        try:
+            with np.load(PERMITTED_FACES_CACHE) as cache:
+                return {
+                    str(filename): (int(mtime), int(size), encoding)
+                    for filename, mtime, size, encoding in zip(
+                        cache["filenames"], cache["mtimes"], cache["sizes"], cache["encodings"])
+                }
+        except Exception as e:
+            logger.warning("Ignoring unreadable encoding cache %s: %s", PERMITTED_FACES_CACHE, e)
+            return {}
+
+    def _save_encoding_cache(self):
+        """Persist the encoding cache atomically so the next load skips unchanged images."""
+        entries = self.encoding_cache
+        try:
+            # Per-process temp name: with several uvicorn workers each one may rewrite the shared cache
+            tmp_path = PERMITTED_FACES_CACHE.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    filenames=np.array(list(entries.keys()), dtype=str),
+                    mtimes=np.array([entry[0] for entry in entries.values()], dtype=np.int64),
+                    sizes=np.array([entry[1] for entry in entries.values()], dtype=np.int64),
+                    encodings=np.array([entry[2] for entry in entries.values()], dtype=np.float64).reshape(-1, 128),
+                )
+            os.replace(tmp_path, PERMITTED_FACES_CACHE)
+        except Exception as e:
+            logger.error("Failed to save encoding cache %s: %s", PERMITTED_FACES_CACHE, e)
+
+    def _encode_permitted_image(self, image_path: Union[str, Path]) -> Optional[Any]:
+        # Same single decode as recognition (frombuffer + cv2/TurboJPEG) rather than a PIL round-trip
+        image = self._decode_rgb(Path(image_path).read_bytes(), reduction=1)
+        if image is None:
+            logger.warning("Could not decode %s", os.path.basename(image_path))
+            return None
+        encodings = face_recognition.face_encodings(image)
+        if not encodings:
+            logger.warning("No face found in %s", os.path.basename(image_path))
+            return None
+        return encodings[0]
+
     def load_permitted_faces(self):
         logger.info("Loading permitted faces...")
-        self.permitted_face_encodings.clear()
-        self.permitted_face_names.clear()
+        encodings: List[Any] = []
+        names: List[str] = []
+        files: List[str] = []
+        encoding_cache: Dict[str, Tuple[int, int, Any]] = {}
 
         if not all([face_recognition_available, cv2_available, numpy_available]):
             logger.warning("A required library (face_recognition, cv2, or numpy) is not available. Skipping face loading.")
             return
 
         if not PERMITTED_FACES_DIR.exists():
-            logger.warning(f"Permitted faces directory does not exist: {PERMITTED_FACES_DIR}")
+            logger.warning("Permitted faces directory does not exist: %s", PERMITTED_FACES_DIR)
             return
-            
-        loaded_count = 0
-        for image_path in PERMITTED_FACES_DIR.glob("*.[jp][pn]g"):
+
+        cached = self._load_encoding_cache()
+        encoded_count = 0
+        # One scandir pass: DirEntry caches file type, so no Path objects or extra stat per file
+        with os.scandir(PERMITTED_FACES_DIR) as entries:
+            image_entries = [
+                entry for entry in entries
+                if entry.is_file() and entry.name.rpartition('.')[2].lower() in PERMITTED_IMAGE_SUFFIXES
+            ]
+
+        for entry in image_entries:
             try:
-                image = face_recognition.load_image_file(str(image_path))
-                encodings = face_recognition.face_encodings(image)
-                if encodings:
-                    self.permitted_face_encodings.append(encodings[0])
-                    self.permitted_face_names.append(image_path.stem)
-                    loaded_count += 1
-                    logger.info(f"Loaded permitted face: {image_path.stem}")
+                stat = entry.stat()
+                cached_entry = cached.get(entry.name)
+                if cached_entry and cached_entry[0] == stat.st_mtime_ns and cached_entry[1] == stat.st_size:
+                    encoding = cached_entry[2]
                 else:
-                    logger.warning(f"No face found in {image_path.name}")
+                    encoding = self._encode_permitted_image(entry.path)
+                    if encoding is None:
+                        continue
+                    encoded_count += 1
+                name = os.path.splitext(entry.name)[0]
+                encoding_cache[entry.name] = (stat.st_mtime_ns, stat.st_size, encoding)
+                encodings.append(encoding)
+                names.append(name)
+                files.append(entry.name)
+                logger.info("Loaded permitted face: %s", name)
             except Exception as e:
-                logger.error(f"Failed to process {image_path.name}: {e}", exc_info=True)
-        
-        logger.info(f"Finished loading permitted faces. Total loaded: {loaded_count}")
+                logger.error("Failed to process %s: %s", entry.name, e, exc_info=True)
 
-    async def perform_face_recognition(self, image_bytes: bytes) -> Dict[str, Any]:
+        # Encoding happens outside the lock; recognition threads only wait for the swap
+        with self.faces_lock:
+            self.permitted_face_encodings = encodings
+            self.permitted_face_names = names
+            self.permitted_face_files = files
+            self.encoding_cache = encoding_cache
+            if encoded_count or encoding_cache.keys() != cached.keys():
+                self._save_encoding_cache()
+            self._build_face_index()
+        logger.info("Finished loading permitted faces. Total loaded: %d (%d newly encoded)",
+                    len(names), encoded_count)
+
+    def add_permitted_face_incremental(self, image_path: Path, name: str, discard_rejected: bool = False) -> bool:
+        """
+        Encode a single permitted face and add it to the in-memory set and cache, replacing any
+        previous entry for the same file. The encode doubles as validation: if the image cannot be
+        decoded or holds no face, False is returned and the file is only deleted when
+        `discard_rejected` is set (uploads; files placed in the directory by hand are left alone).
+        """
         if not all([face_recognition_available, cv2_available, numpy_available]):
-            return {"status": "error", "message": "Face recognition feature not available."}
-        
+            return False
+
+        # Only an undecodable image or one without a face is a rejection; anything else (read errors,
+        # CUDA OOM, ...) propagates and the file is kept
+        encoding = self._encode_permitted_image(image_path)
+        if encoding is None:
+            self.remove_permitted_face(image_path.name)
+            if discard_rejected:
+                # Unusable uploads would otherwise be re-decoded on every startup (failures are not cached)
+                image_path.unlink(missing_ok=True)
+            logger.warning("Rejected permitted face image %s", image_path.name)
+            return False
+
+        stat = image_path.stat()
+        with self.faces_lock:
+            if image_path.name in self.permitted_face_files:
+                position = self.permitted_face_files.index(image_path.name)
+                self.permitted_face_encodings[position] = encoding
+                self.permitted_face_names[position] = name
+            else:
+                self.permitted_face_encodings.append(encoding)
+                self.permitted_face_names.append(name)
+                self.permitted_face_files.append(image_path.name)
+            self.encoding_cache[image_path.name] = (stat.st_mtime_ns, stat.st_size, encoding)
+
+            self._save_encoding_cache()
+            self._build_face_index()
+        logger.info("Added permitted face incrementally: %s", name)
+        return True
+
+    def remove_permitted_face(self, filename: str):
+        """Drop a permitted face (by image filename) from memory and the encoding cache."""
+        with self.faces_lock:
+            removed = filename in self.permitted_face_files
+            if removed:
+                position = self.permitted_face_files.index(filename)
+                del self.permitted_face_encodings[position]
+                del self.permitted_face_names[position]
+                del self.permitted_face_files[position]
+            if self.encoding_cache.pop(filename, None) is not None:
+                self._save_encoding_cache()
+            if removed:
+                self._build_face_index()
+
+    def sync_permitted_face(self, image_path: Path):
+        """
+        Bring one permitted face in line with its file on disk: drop it if the file is gone,
+        re-encode it if its mtime/size no longer match the cached encoding, otherwise do nothing.
+        """
         try:
-            start_time = time.time()
-            
-            # Fast image decoding
-            image_array = np.frombuffer(image_bytes, np.uint8)
-            image_bgr = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-            if image_bgr is None:
-                raise ValueError("Failed to decode image.")
-            
-            # Enhance image quality (contrast and brightness)
-            image_bgr = cv2.convertScaleAbs(image_bgr, alpha=1.2, beta=40)
-            
-            # Convert BGR to RGB (required for face_recognition)
-            image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-
-            # GPU-accelerated face detection for speed and accuracy
-            face_locations = face_recognition.face_locations(image_rgb, model="hog")  # CNN uses GPU for faster, more accurate detection
+            stat = image_path.stat()
+        except FileNotFoundError:
+            self.remove_permitted_face(image_path.name)
+            logger.info("Removed permitted face: %s", image_path.stem)
+            return
+
+        with self.faces_lock:
+            cached_entry = self.encoding_cache.get(image_path.name)
+            if cached_entry and cached_entry[0] == stat.st_mtime_ns and cached_entry[1] == stat.st_size:
+                return
+        # Never deletes: a file that is still being copied, or holds no face, is only skipped
+        self.add_permitted_face_incremental(image_path, image_path.stem)
+
+    def warm_up(self):
+        """
+        Pin the CUDA device and run one dummy detection + encoding so the first real
+        request does not pay for model loading and CUDA context initialization.
+        """
+        if not all([face_recognition_available, numpy_available]):
+            return
+
+        start_ns = time.monotonic_ns()
+        try:
+            if dlib_cuda_available:
+                dlib.cuda.set_device(CUDA_DEVICE)
+                logger.info("dlib pinned to CUDA device %d", CUDA_DEVICE)
+            dummy = np.zeros((160, 160, 3), dtype=np.uint8)
+            if FACE_DETECTOR == "mediapipe":
+                self._get_face_detector().process(dummy)
+            else:
+                face_recognition.face_locations(dummy, model="hog")
+            face_recognition.face_encodings(dummy, known_face_locations=[(0, 160, 160, 0)])
+            if numba_available:
+                # Compile (or load from cache) the distance kernel now rather than on a large gallery's first frame
+                _nearest_encoding(np.zeros((2, 128), dtype=np.float32), np.zeros(128, dtype=np.float32))
+            logger.info("Face models warmed up in %.3fs", (time.monotonic_ns() - start_ns) / 1e9)
+        except Exception as e:
+            logger.warning("Face model warm-up failed: %s", e)
+
+    def close(self):
+        """
+        Release recognition resources on shutdown. Waits for a batch already running on the
+        identification thread so no GPU call is cut off mid-flight.
+        """
+        self.identification_executor.shutdown(wait=True)
+        if self.face_detector is not None:
+            self.face_detector.close()
+            self.face_detector = None
+        if gpu_jpeg_available:
+            torch.cuda.empty_cache()
+        logger.info("DataStore resources released.")
+
+    async def perform_face_recognition(self, image_bytes: Union[bytes, bytearray],
+                                       client_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue an image for recognition; concurrent requests are processed together in one batch.
+        Identical frames already in flight, or recognized within FRAME_CACHE_TTL seconds, share
+        that result instead of being recognized again. When `client_key` is given and
+        FRAME_HASH_CACHE_TTL is set, a frame that looks the same as one that client sent recently
+        also reuses its result, unless that result granted access.
+        """
+        frame_key = hashlib.blake2b(image_bytes, digest_size=16).digest()
+        cached = self._get_cached_result(self.exact_frame_cache, frame_key, FRAME_CACHE_TTL)
+        if cached is not None:
+            # Byte-identical upload: skip decoding as well as detection and encoding
+            return cached
+
+        pending = self.pending_recognitions.get(frame_key)
+        if pending is None:
+            # The recognition runs as its own task, so a caller disconnecting does not cancel it
+            # for the other requests waiting on the same frame
+            pending = asyncio.ensure_future(self._recognize_frame(frame_key, image_bytes, client_key))
+            pending.add_done_callback(lambda task: self._finish_pending(frame_key, task))
+            self.pending_recognitions[frame_key] = pending
+        # Callers annotate their result dict, so each one gets its own copy
+        return dict(await asyncio.shield(pending))
+
+    async def _recognize_frame(self, frame_key: bytes, image_bytes: Union[bytes, bytearray],
+                               client_key: Optional[str]) -> Dict[str, Any]:
+        gallery_version = self.gallery_version
+        result = await self._recognize(image_bytes, client_key)
+        self._store_result(self.exact_frame_cache, frame_key, gallery_version, result, FRAME_CACHE_TTL)
+        return result
+
+    def _finish_pending(self, frame_key: bytes, task: asyncio.Task):
+        if self.pending_recognitions.get(frame_key) is task:
+            del self.pending_recognitions[frame_key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved when every waiter has gone away
+
+    async def _recognize(self, image_bytes: Union[bytes, bytearray],
+                         client_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Two-stage pipeline: decoding runs in parallel on the request threadpool (OpenCV and
+        libjpeg-turbo release the GIL), then detection + encoding are batched onto the single
+        identification thread so the GPU sees one caller at a time.
+        """
+        if not all([face_recognition_available, cv2_available, numpy_available]):
+            return {"status": "error", "message": "Face recognition feature not available."}
+
+        use_frame_cache = client_key is not None and FRAME_HASH_CACHE_TTL > 0
+        async with self.recognition_slots:
+            start_ns = time.monotonic_ns()
+            try:
+                image_rgb, detection_image, scale, frame_hash = await run_in_threadpool(
+                    self._prepare_image, image_bytes, use_frame_cache
+                )
+            except Exception as e:
+                logger.error("Error during face recognition: %s", e)
+                return {"status": "error", "message": str(e), "processing_time": 0}
+
+            if use_frame_cache:
+                cache_key = (client_key, frame_hash)
+                cached = self._get_cached_result(self.frame_cache, cache_key, FRAME_HASH_CACHE_TTL)
+                if cached is not None:
+                    # Same scene from the same camera: skip detection and encoding entirely
+                    return cached
+                gallery_version = self.gallery_version
+
+            result = await self.recognition_batcher.submit((image_rgb, detection_image, scale, start_ns))
+            # A similar-looking frame may show a different person, so access grants are never reused
+            if use_frame_cache and result.get("status") != "permitted_face":
+                self._store_result(self.frame_cache, cache_key, gallery_version, result, FRAME_HASH_CACHE_TTL)
+            return result
+
+    def _get_cached_result(self, cache: OrderedDict, key: Any, ttl: float) -> Optional[Dict[str, Any]]:
+        """Return a copy of a result cached under `key` within `ttl` seconds against the current gallery, or None."""
+        if ttl <= 0:
+            return None
+        cached = cache.get(key)
+        if cached is None or cached[1] != self.gallery_version or time.monotonic() - cached[0] > ttl:
+            return None
+        cache.move_to_end(key)
+        return dict(cached[2])
+
+    def _store_result(self, cache: OrderedDict, key: Any, gallery_version: int, result: Dict[str, Any], ttl: float):
+        if ttl <= 0 or result.get("status") == "error":
+            return
+        cache[key] = (time.monotonic(), gallery_version, dict(result))
+        cache.move_to_end(key)
+        if len(cache) > FRAME_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    def recognize_batch(self, frames: List[Tuple[Any, Any, float, int]]) -> List[Dict[str, Any]]:
+        """
+        Identify faces in a batch of decoded frames. Runs on the identification thread.
+        Detection runs per frame; the most prominent face of every frame is then encoded in one call.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(frames)
+        to_encode = []  # (position, image_rgb, location, faces_detected, start_ns)
+
+        for position, (image_rgb, detection_image, scale, start_ns) in enumerate(frames):
+            try:
+                face_locations, encodable_locations = self._detect_faces(image_rgb, detection_image, scale)
+            except Exception as e:
+                logger.error("Error during face recognition: %s", e)
+                results[position] = {"status": "error", "message": str(e), "processing_time": 0}
+                continue
+
             if not face_locations:
-                processing_time = time.time() - start_time
-                return {
+                processing_time = (time.monotonic_ns() - start_ns) / 1e9
+                results[position] = {
                     "status": "no_face_detected", 
                     "faces_detected": 0,
                     "processing_time": round(processing_time, 4)
                 }
+            elif not encodable_locations:
+                results[position] = self._match_result(None, len(face_locations), start_ns)
+            else:
+                # Quick face encoding (only process first face for speed)
+                if scale != 1.0:
+                    self._enhance_face_region(image_rgb, encodable_locations[0])
+                to_encode.append((position, image_rgb, encodable_locations[0], len(face_locations), start_ns))
 
-            # Quick face encoding (only process first face for speed)
-            face_encodings = face_recognition.face_encodings(image_rgb, face_locations[:1])  # Only process first face
-            
-            best_match_name = "Unknown"
-            best_confidence = 0.0
-
-            if self.permitted_face_encodings and face_encodings:
-                face_encoding = face_encodings[0]  # Only check first face
-                face_distances = face_recognition.face_distance(self.permitted_face_encodings, face_encoding)
-                
-                if len(face_distances) > 0:
-                    best_match_index = np.argmin(face_distances)
-                    distance = face_distances[best_match_index]
+        if to_encode:
+            try:
+                encodings = self._encode_faces([item[1] for item in to_encode], [item[2] for item in to_encode])
+            except Exception as e:
+                logger.error("Error during face recognition: %s", e)
+                for position, *_ in to_encode:
+                    results[position] = {"status": "error", "message": str(e), "processing_time": 0}
+                return results
+
+            for (position, _, _, faces_detected, start_ns), face_encoding in zip(to_encode, encodings):
+                results[position] = self._match_result(face_encoding, faces_detected, start_ns)
+        return results
+
+    def _decode_rgb(self, image_bytes: Union[bytes, bytearray],
+                    reduction: int = IMAGE_DECODE_REDUCTION) -> Optional[Any]:
+        """Decode an uploaded frame to an RGB array, preferring nvJPEG, then libjpeg-turbo for JPEGs."""
+        if gpu_jpeg_available and image_bytes[:3] == JPEG_SIGNATURE:
+            try:
+                return self._decode_jpeg_gpu(image_bytes, reduction)
+            except Exception as e:
+                logger.debug("GPU JPEG decode failed, falling back to CPU: %s", e)
+
+        if turbojpeg_available and image_bytes[:3] == JPEG_SIGNATURE:
+            try:
+                scaling = (1, reduction) if reduction > 1 else None
+                return turbojpeg.decode(image_bytes, pixel_format=TJPF_RGB, scaling_factor=scaling)
+            except Exception as e:
+                logger.debug("TurboJPEG decode failed, falling back to OpenCV: %s", e)
+
+        # Fast image decoding (frombuffer aliases the upload buffer, no copy)
+        image_array = np.frombuffer(image_bytes, np.uint8)
+        reduced_flag = IMREAD_REDUCED_FLAGS.get(reduction)
+        if reduced_flag is not None:
+            # Reduced decodes are always BGR
+            decode_flag, decodes_to_rgb = reduced_flag, False
+        elif IMREAD_COLOR_RGB is not None:
+            decode_flag, decodes_to_rgb = IMREAD_COLOR_RGB, True
+        else:
+            decode_flag, decodes_to_rgb = cv2.IMREAD_COLOR, False
+        image_rgb = cv2.imdecode(image_array, decode_flag)
+        # BGR output: swap to RGB in place (required for face_recognition, which also needs a contiguous array)
+        if image_rgb is not None and not decodes_to_rgb:
+            cv2.cvtColor(image_rgb, cv2.COLOR_BGR2RGB, dst=image_rgb)
+        return image_rgb
+
+    def _decode_jpeg_gpu(self, image_bytes: Union[bytes, bytearray], reduction: int) -> Any:
+        """
+        Decode a JPEG with nvJPEG and apply the reduction on the GPU; only the final
+        RGB frame is copied back, since dlib works on host memory.
+        """
+        # frombuffer needs a writable buffer; uploads already arrive as bytearrays
+        data = torch.frombuffer(image_bytes if isinstance(image_bytes, bytearray) else bytearray(image_bytes),
+                                dtype=torch.uint8)
+        image = decode_jpeg(data, mode=ImageReadMode.RGB, device=f"cuda:{CUDA_DEVICE}")  # (3, H, W)
+        if reduction > 1:
+            # Integer-factor average pooling is the same filter as INTER_AREA
+            image = torch.nn.functional.avg_pool2d(image.unsqueeze(0).float(), reduction)
+            image = image.squeeze(0).round_().to(torch.uint8)
+        return image.permute(1, 2, 0).contiguous().cpu().numpy()
+
+    def _prepare_image(self, image_bytes: Union[bytes, bytearray],
+                       with_hash: bool = False) -> Tuple[Any, Any, float, Optional[bytes]]:
+        """
+        Decode and enhance an uploaded frame (CPU stage). Returns the frame, the copy to run
+        detection on, the scale between them (1.0 when the frame is already small enough),
+        and the frame's perceptual hash when `with_hash` is set.
+        """
+        image_rgb = self._decode_rgb(image_bytes)
+        if image_rgb is None:
+            raise ValueError("Failed to decode image.")
+
+        # HOG cost grows with pixel count, so detect on a downscaled copy. Resize first so the
+        # contrast pass below touches the small copy only; the full frame is enhanced later,
+        # and only around the face that gets encoded (see _enhance_face_region)
+        longest_side = max(image_rgb.shape[:2])
+        if DETECTION_MAX_DIMENSION > 0 and longest_side > DETECTION_MAX_DIMENSION:
+            scale = DETECTION_MAX_DIMENSION / longest_side
+            detection_image = cv2.resize(image_rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+            detection_image = image_rgb
+
+        # Enhance image quality (contrast and brightness) in place: the buffer is ours alone
+        cv2.convertScaleAbs(detection_image, dst=detection_image, alpha=CONTRAST_ALPHA, beta=CONTRAST_BETA)
+        frame_hash = self._average_hash(detection_image) if with_hash else None
+        return image_rgb, detection_image, scale, frame_hash
+
+    def _average_hash(self, image_rgb: Any) -> bytes:
+        """64-bit average hash: an 8x8 grayscale thumbnail thresholded at its mean. Robust to JPEG noise."""
+        thumbnail = cv2.resize(cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY), (8, 8), interpolation=cv2.INTER_AREA)
+        return np.packbits(thumbnail > thumbnail.mean()).tobytes()
+
+    def _enhance_face_region(self, image_rgb: Any, location: Tuple[int, int, int, int]):
+        """
+        Apply the contrast pass in place to the area around one face box. The landmark model
+        and the aligned face chip never read beyond it, so encodings match a fully enhanced frame.
+        """
+        top, right, bottom, left = location
+        margin = max(bottom - top, right - left) // 2
+        height, width = image_rgb.shape[:2]
+        region = image_rgb[max(0, top - margin):min(height, bottom + margin),
+                           max(0, left - margin):min(width, right + margin)]
+        # Assign back explicitly: region is a strided view, and it is only a face-sized copy
+        region[...] = cv2.convertScaleAbs(region, alpha=CONTRAST_ALPHA, beta=CONTRAST_BETA)
+
+    def _get_face_detector(self):
+        if self.face_detector is None:
+            # Short-range model: cameras are mounted within a couple of metres of the subject
+            self.face_detector = mp.solutions.face_detection.FaceDetection(
+                model_selection=0, min_detection_confidence=0.5
+            )
+        return self.face_detector
+
+    def _locate_faces(self, image_rgb: Any) -> List[Tuple[int, int, int, int]]:
+        """Detect faces as (top, right, bottom, left) boxes, the format face_recognition expects."""
+        if FACE_DETECTOR != "mediapipe":
+            return face_recognition.face_locations(image_rgb, number_of_times_to_upsample=HOG_UPSAMPLE, model="hog")
+
+        detections = self._get_face_detector().process(image_rgb).detections
+        if not detections:
+            return []
+        height, width = image_rgb.shape[:2]
+        face_locations = []
+        for detection in detections:
+            box = detection.location_data.relative_bounding_box
+            top = max(0, int(box.ymin * height))
+            left = max(0, int(box.xmin * width))
+            bottom = min(height, int((box.ymin + box.height) * height))
+            right = min(width, int((box.xmin + box.width) * width))
+            if bottom > top and right > left:
+                face_locations.append((top, right, bottom, left))
+        return face_locations
+
+    def _detect_faces(self, image_rgb: Any, detection_image: Any, scale: float) -> Tuple[List[Any], List[Any]]:
+        """Return all detected face boxes and the encodable ones, largest (most prominent) first."""
+        face_locations = self._locate_faces(detection_image)
+        if scale != 1.0:
+            # Map boxes back onto the full-resolution frame so encodings keep their accuracy
+            height, width = image_rgb.shape[:2]
+            face_locations = [
+                (max(0, int(top / scale)), min(width, int(right / scale)),
+                 min(height, int(bottom / scale)), max(0, int(left / scale)))
+                for top, right, bottom, left in face_locations
+            ]
+
+        # Drop faces too small to produce a usable encoding
+        min_face_area = MIN_FACE_SIZE * MIN_FACE_SIZE
+        encodable_locations = sorted(
+            (loc for loc in face_locations if (loc[2] - loc[0]) * (loc[1] - loc[3]) >= min_face_area),
+            key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]),
+            reverse=True
+        )
+        dropped_count = len(face_locations) - len(encodable_locations)
+        if dropped_count:
+            logger.debug("Skipped %d face(s) smaller than %dx%dpx", dropped_count, MIN_FACE_SIZE, MIN_FACE_SIZE)
+        return face_locations, encodable_locations
+
+    def _encode_faces(self, images: List[Any], locations: List[Any]) -> List[Any]:
+        """
+        Encode one face per image. Several images go through dlib's batched
+        compute_face_descriptor in a single call; a lone image uses face_encodings.
+        """
+        if len(images) > 1 and dlib is not None:
+            try:
+                batch_shapes = []
+                for image, location in zip(images, locations):
+                    shapes = dlib.full_object_detections()
+                    for shape in face_recognition.api._raw_face_landmarks(image, [location], model="small"):
+                        shapes.append(shape)
+                    batch_shapes.append(shapes)
+                descriptors = face_recognition.api.face_encoder.compute_face_descriptor(images, batch_shapes, 1)
+                return [np.array(image_descriptors[0]) for image_descriptors in descriptors]
+            except (AttributeError, TypeError) as e:
+                # dlib builds without the batch overload: fall back to one call per image
+                logger.debug("Batched face encoding unavailable, encoding per image: %s", e)
+        return [face_recognition.face_encodings(image, [location])[0] for image, location in zip(images, locations)]
+
+    def _match_result(self, face_encoding: Optional[Any], faces_detected: int, start_ns: int) -> Dict[str, Any]:
+        """Match an encoding (None when no face was encodable) and build the recognition response."""
+        best_match_name = "Unknown"
+        best_confidence = 0.0
+
+        if face_encoding is not None:
+            with self.faces_lock:
+                if self.permitted_face_encodings:
+                    best_match_index, distance = self._find_best_match(face_encoding)
                     confidence = 1 - distance
-                    
+
                     # Lower threshold for faster matching
                     if confidence > 0.5:  # Reduced from typical 0.6 for speed
                         best_confidence = confidence
                         best_match_name = self.permitted_face_names[best_match_index]
 
-            processing_time = time.time() - start_time
-            
-            if best_match_name != "Unknown":
-                return {
-                    "status": "permitted_face",
-                    "recognizedAs": best_match_name,
-                    "confidence": round(best_confidence, 4),
-                    "faces_detected": len(face_locations),
-                    "processing_time": round(processing_time, 4)
-                }
-            else:
-                return {
-                    "status": "unknown_face",
-                    "recognizedAs": None,
-                    "confidence": 0.0,
-                    "faces_detected": len(face_locations),
-                    "processing_time": round(processing_time, 4)
-                }
-        except Exception as e:
-            logger.error(f"Error during face recognition: {e}")
+        processing_time = (time.monotonic_ns() - start_ns) / 1e9
+        
+        if best_match_name != "Unknown":
             return {
-                "status": "error", 
-                "message": str(e),
-                "processing_time": 0
+                "status": "permitted_face",
+                "recognizedAs": best_match_name,
+                "confidence": round(best_confidence, 4),
+                "faces_detected": faces_detected,
+                "processing_time": round(processing_time, 4)
+            }
+        else:
+            return {
+                "status": "unknown_face",
+                "recognizedAs": None,
+                "confidence": 0.0,
+                "faces_detected": faces_detected,
+                "processing_time": round(processing_time, 4)
             }
 
-    def register_device(self, device_data: Dict[str, Any]) -> Dict[str, Any]:
+    def register_device(self, device_data: Dict[str, Any]) -> Device:
         device_id = device_data.get('id')
         if not device_id:
             raise ValueError("Device ID is required.")
         
-        current_time_ms = time.time() * 1000
-        if device_id in self.devices:
-            self.devices[device_id].update(device_data)
-            self.devices[device_id]['lastSeen'] = current_time_ms
+        current_time_ms = now_ms()
+        device = self.devices.get(device_id)
+        if device is not None:
+            name = device_data.get('name', device.name)
+            status = device_data.get('status', device.status)
+            # Re-registering with the same details only refreshes lastSeen, which the listing TTL covers
+            changed = name != device.name or status != device.status
+            device.name = name
+            device.status = status
+            device.lastSeen = current_time_ms
         else:
-            device_data['lastSeen'] = current_time_ms
-            self.devices[device_id] = device_data
+            device = Device(device_id, device_data.get('name') or f'Device-{device_id}',
+                            device_data.get('status', 'online'), current_time_ms)
+            self.devices[device_id] = device
+            changed = True
+        if changed:
+            self._track_status(device_id, device.status)
+            self.devices_version += 1
         
-        logger.info(f"Registered/updated device: {device_id}")
-        return self.devices[device_id]
+        logger.info("Registered/updated device: %s", device_id)
+        return device
+
+    def touch_device(self, device_id: str) -> Device:
+        """
+        Mark a streaming device online and refresh its lastSeen in place. Called for every frame,
+        so known devices only get two attribute writes; unknown ones are registered with a default name.
+        """
+        device = self.devices.get(device_id)
+        if device is None:
+            return self.register_device({'id': device_id, 'status': 'online'})
+
+        device.status = 'online'
+        device.lastSeen = now_ms()
+        self.online_device_ids.add(device_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Device seen: %s", device_id)
+        return device
+
+    def _track_status(self, device_id: str, status: Optional[str]):
+        if status in ONLINE_STATUSES:
+            self.online_device_ids.add(device_id)
+        else:
+            self.online_device_ids.discard(device_id)
+
+    def count_online_devices(self) -> int:
+        return len(self.online_device_ids)
 
-    def get_all_devices(self) -> List[Dict[str, Any]]:
+    def get_all_devices(self) -> List[Device]:
         return list(self.devices.values())
 
 # Create a single, shared instance of the DataStore
@@ -5,10 +5,17 @@ import functools
 import time
 import inspect
 from typing import Callable, Any, Dict, Optional
-from fastapi import Request
+from fastapi import HTTPException, Request
 
 logger = logging.getLogger(__name__)
 
+def _log_failure(module_name: str, func_name: str, elapsed: float, exc: Exception):
+    # Client errors (4xx) are routine on request paths; keep ERROR for real failures
+    if isinstance(exc, HTTPException) and exc.status_code < 500:
+        logger.warning("%s.%s rejected after %.6fs: %s %s", module_name, func_name, elapsed, exc.status_code, exc.detail)
+    else:
+        logger.error("ERROR: %s.%s failed after %.6fs: %s", module_name, func_name, elapsed, exc)
+
 def log_function_call(func: Callable) -> Callable:
     """
     Decorator to log function calls with parameters and execution time
@@ -21,17 +28,20 @@ def log_function_call(func: Callable) -> Callable:
             module_name = func.__module__
             
             # Simple function call logging without detailed arguments to avoid serialization issues
-            logger.debug(f"CALL: {module_name}.{func_name}() - {len(args)} args, {len(kwargs)} kwargs")
+            debug_enabled = logger.isEnabledFor(logging.DEBUG)
+            if debug_enabled:
+                logger.debug("CALL: %s.%s() - %d args, %d kwargs", module_name, func_name, len(args), len(kwargs))
             
-            start_time = time.time()
+            start_time = time.perf_counter()
             try:
                 result = await func(*args, **kwargs)
-                elapsed = time.time() - start_time
-                logger.debug(f"RETURN: {module_name}.{func_name} completed in {elapsed:.6f}s")
+                elapsed = time.perf_counter() - start_time
+                if debug_enabled:
+                    logger.debug("RETURN: %s.%s completed in %.6fs", module_name, func_name, elapsed)
                 return result
             except Exception as e:
-                elapsed = time.time() - start_time
-                logger.error(f"ERROR: {module_name}.{func_name} failed after {elapsed:.6f}s: {str(e)}")
+                elapsed = time.perf_counter() - start_time
+                _log_failure(module_name, func_name, elapsed, e)
                 raise
         
         return async_wrapper
@@ -42,17 +52,20 @@ def log_function_call(func: Callable) -> Callable:
             module_name = func.__module__
             
             # Simple function call logging without detailed arguments to avoid serialization issues
-            logger.debug(f"CALL: {module_name}.{func_name}() - {len(args)} args, {len(kwargs)} kwargs")
+            debug_enabled = logger.isEnabledFor(logging.DEBUG)
+            if debug_enabled:
+                logger.debug("CALL: %s.%s() - %d args, %d kwargs", module_name, func_name, len(args), len(kwargs))
             
-            start_time = time.time()
+            start_time = time.perf_counter()
             try:
                 result = func(*args, **kwargs)
-                elapsed = time.time() - start_time
-                logger.debug(f"RETURN: {module_name}.{func_name} completed in {elapsed:.6f}s")
+                elapsed = time.perf_counter() - start_time
+                if debug_enabled:
+                    logger.debug("RETURN: %s.%s completed in %.6fs", module_name, func_name, elapsed)
                 return result
             except Exception as e:
-                elapsed = time.time() - start_time
-                logger.error(f"ERROR: {module_name}.{func_name} failed after {elapsed:.6f}s: {str(e)}")
+                elapsed = time.perf_counter() - start_time
+                _log_failure(module_name, func_name, elapsed, e)
                 raise
         
         return sync_wrapper
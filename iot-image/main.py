@@ -1,20 +1,23 @@
+import asyncio
 import logging
 import sys
 import time
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
 # Import from our new modules
 import config
 from api_routes import router as api_router
 from data_store import data_store
+from permitted_faces_watcher import permitted_faces_watcher
 from ssh_tunnel import (create_ssh_tunnel, get_tunnel_instance,
                         stop_ssh_tunnel)
-from middleware import RequestLoggingMiddleware
+from middleware import MaxBodySizeMiddleware, RequestLoggingMiddleware
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +26,14 @@ async def lifespan(app: FastAPI):
     # --- Startup Logic ---
     logger.info("Application starting up...")
     
-    # Load permitted faces into memory
-    data_store.load_permitted_faces()
+    # Warm up and load permitted faces on the identification thread: it owns the face models, and
+    # dlib's CUDA device selection is per thread, so the device is pinned before anything is encoded
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(data_store.identification_executor, data_store.warm_up)
+    await loop.run_in_executor(data_store.identification_executor, data_store.load_permitted_faces)
+    # From here on, changes to the permitted faces directory are applied one file at a time
+    permitted_faces_watcher.start()
+    data_store.recognition_batcher.start()
 
     # Start SSH reverse tunnel if configured
     if config.SSH_HOST and config.SSH_USER:
@@ -40,10 +49,14 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("SSH tunnel environment variables not set. Skipping tunnel.")
     
-    app.state.start_time = time.time()
+    app.state.start_time = time.monotonic()
+    app.state.tunnel_status_cache = (0.0, False)
     yield
     # --- Shutdown Logic ---
     logger.info("Application shutting down...")
+    await data_store.recognition_batcher.stop()
+    await run_in_threadpool(permitted_faces_watcher.stop)
+    await run_in_threadpool(data_store.close)
     stop_ssh_tunnel()
     logger.info("Shutdown complete.")
 
@@ -52,12 +65,20 @@ app = FastAPI(
     title="IoT Backend GPU Server",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     # Optimize for high throughput
     docs_url="/docs" if config.RELOAD_DEBUG else None,
     redoc_url="/redoc" if config.RELOAD_DEBUG else None
 )
 
 # --- Add Middleware ---
+# Cap request bodies before they reach the routes (innermost, so 413s still get CORS headers and logging)
+app.add_middleware(
+    MaxBodySizeMiddleware,
+    max_body_size=config.MAX_REQUEST_BODY_BYTES,
+    path_limits={"/api/v1/recognize/batch": config.MAX_BATCH_REQUEST_BODY_BYTES},
+)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -74,7 +95,7 @@ app.add_middleware(RequestLoggingMiddleware)
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception for request {request.url.path}: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"status": "error", "message": "An internal server error occurred."}
     )
@@ -88,42 +109,68 @@ app.mount("/data", StaticFiles(directory=config.DATA_DIR), name="data")
 async def root():
     return {"message": "Server is running."}
 
+TUNNEL_STATUS_TTL = 5.0  # Seconds to reuse the tunnel status between health probes
+
+# Static part of the health payload, serialized once; only the tunnel flag and uptime vary
+_HEALTH_PREFIX = (
+    b'{"status":"healthy","face_recognition_ready":'
+    + (b'true' if config.face_recognition_available else b'false')
+    + b',"ssh_tunnel_active":'
+)
+
 @app.get("/health")
 async def health_check():
-    tunnel = get_tunnel_instance()
-    return {
-        "status": "healthy",
-        "uptime_seconds": round(time.time() - app.state.start_time),
-        "face_recognition_ready": config.face_recognition_available,
-        "ssh_tunnel_active": tunnel.is_active if tunnel else False
-    }
+    now = time.monotonic()
+    checked_at, tunnel_active = app.state.tunnel_status_cache
+    if now - checked_at > TUNNEL_STATUS_TTL:
+        tunnel = get_tunnel_instance()
+        tunnel_active = bool(tunnel and tunnel.is_active)
+        app.state.tunnel_status_cache = (now, tunnel_active)
+    content = (
+        _HEALTH_PREFIX
+        + (b'true' if tunnel_active else b'false')
+        + b',"uptime_seconds":'
+        + str(round(now - app.state.start_time)).encode()
+        + b'}'
+    )
+    return Response(content=content, media_type="application/json")
 
 # --- WebSocket Support ---
 from fastapi import WebSocket, WebSocketDisconnect
-import json
+import orjson
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: list[WebSocket] = []
+        self.active_connections: set[WebSocket] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
         logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        self.active_connections.discard(websocket)
         logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
 
     async def broadcast(self, message: dict):
         if self.active_connections:
-            message_str = json.dumps(message)
-            for connection in self.active_connections.copy():
-                try:
-                    await connection.send_text(message_str)
-                except:
-                    self.active_connections.remove(connection)
+            # Encode once and share a single ASGI send message across all connections.
+            # Binary frames skip the per-connection UTF-8 encode; text frames stay the default
+            # because browser clients parse the payload as a string.
+            payload = orjson.dumps(message)
+            if config.WEBSOCKET_BINARY_FRAMES:
+                frame = {"type": "websocket.send", "bytes": payload}
+            else:
+                frame = {"type": "websocket.send", "text": payload.decode()}
+            # Send to every client concurrently so one slow client does not delay the rest
+            connections = list(self.active_connections)
+            results = await asyncio.gather(
+                *(connection.send(frame) for connection in connections),
+                return_exceptions=True
+            )
+            for connection, result in zip(connections, results):
+                if isinstance(result, Exception):
+                    self.active_connections.discard(connection)
 
 manager = ConnectionManager()
 
@@ -150,7 +197,14 @@ if __name__ == "__main__":
         port=config.PORT,
         reload=config.RELOAD_DEBUG,
         log_level=config.UVICORN_LOG_LEVEL.lower(),
-        workers=1,  # Single worker for GPU tasks
+        loop=config.UVICORN_LOOP,
+        http=config.UVICORN_HTTP,
+        # Reload mode only supports a single worker
+        workers=1 if config.RELOAD_DEBUG else config.WORKERS,
+        backlog=config.UVICORN_BACKLOG,
+        timeout_keep_alive=config.UVICORN_TIMEOUT_KEEP_ALIVE,
+        limit_concurrency=config.UVICORN_LIMIT_CONCURRENCY,
+        limit_max_requests=config.UVICORN_LIMIT_MAX_REQUESTS,
         access_log=False,  # Disable access logs for performance
         use_colors=False if not config.RELOAD_DEBUG else True
     )
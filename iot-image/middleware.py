@@ -1,114 +1,215 @@
 # middleware.py
+import asyncio
+import bisect
+import itertools
+import os
 import time
 import logging
-import json
-import uuid
-from datetime import datetime
-from typing import Dict, Any, Optional
+import traceback
+from typing import Dict, Optional
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
-from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from fastapi.responses import ORJSONResponse
+import orjson
+
+from config import REQUEST_LOG_PRETTY
 
 logger = logging.getLogger(__name__)
 
+# Request ids: process/start-time prefix plus a per-process counter (unique per run, no urandom read)
+_REQUEST_ID_PREFIX = f"{os.getpid():x}-{int(time.time()):x}-"
+_request_counter = itertools.count()
+
+# Log banner edges, built once instead of per request
+_BANNER_TOP = "┌" + "─" * 60
+_BANNER_BOTTOM = "└" + "─" * 60
+
+# Epoch second and its formatted "YYYY-MM-DD HH:MM:SS" prefix, refreshed at most once per second
+_timestamp_cache = [None, ""]
+
+
+def _fast_timestamp() -> str:
+    """Local time as "YYYY-MM-DD HH:MM:SS.mmm", running strftime only when the second changes."""
+    now = time.time()
+    second = int(now)
+    if second != _timestamp_cache[0]:
+        _timestamp_cache[1] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        _timestamp_cache[0] = second
+    return f"{_timestamp_cache[1]}.{int((now - second) * 1000):03d}"
+
+
+# Status code ranges (lower bounds) and their log emoji/label, looked up with bisect
+_STATUS_BOUNDS = [200, 300, 400, 500]
+_STATUS_LABELS = [
+    ("ℹ️", "INFO"), ("✅", "SUCCESS"), ("⚠️", "REDIRECT"), ("❌", "CLIENT ERROR"), ("🔥", "SERVER ERROR")
+]
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class MaxBodySizeMiddleware:
+    """
+    Pure ASGI middleware that rejects request bodies larger than `max_body_size` with 413.
+    `path_limits` overrides the limit for specific paths (e.g. multi-file uploads).
+    Requests declaring an oversized Content-Length are refused before any body is read;
+    bodies without a usable Content-Length are counted as they stream in and aborted
+    as soon as the limit is crossed.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_limits = path_limits or {}
+
+    async def _reject(self, send: Send, limit: int):
+        response = ORJSONResponse(
+            status_code=413,
+            content={"detail": f"Request body exceeds {limit} bytes."}
+        )
+        await send({"type": "http.response.start", "status": response.status_code,
+                    "headers": response.raw_headers})
+        await send({"type": "http.response.body", "body": response.body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.path_limits.get(scope["path"], self.max_body_size)
+        for key, value in scope["headers"]:
+            if key == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    logger.warning("Rejected %s %s: Content-Length %s exceeds %d bytes",
+                                   scope["method"], scope["path"], value.decode(), limit)
+                    await self._reject(send, limit)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message: Message):
+            nonlocal response_started
+            # Once the limit is hit, whatever the app produces from the aborted body is dropped
+            if exceeded:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            logger.warning("Rejected %s %s: streamed body exceeded %d bytes",
+                           scope["method"], scope["path"], limit)
+            await self._reject(send, limit)
+
 class RequestLoggingMiddleware(BaseHTTPMiddleware):
     def __init__(self, app: ASGIApp):
         super().__init__(app)
         self.request_id_header = "X-Request-ID"
-        
-    async def extract_request_body(self, request: Request) -> Optional[Dict[str, Any]]:
-        """Extract request body for logging if it's a JSON payload"""
-        if request.headers.get("content-type") == "application/json":
-            try:
-                body = await request.json()
-                # Sanitize sensitive data if needed
-                return body
-            except:
-                return None
-        return None
+        # Bound once so dispatch skips the global + attribute lookups on each log call
+        self._log = logger.info
+        self._err = logger.error
         
     async def dispatch(self, request: Request, call_next):
         # Generate unique request ID
-        request_id = str(uuid.uuid4())
+        request_id = _REQUEST_ID_PREFIX + format(next(_request_counter), "x")
         request.state.request_id = request_id
         
         # Get timestamp at start of request
-        start_time = time.time()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        # Durations use the event loop's monotonic clock; wall-clock time is only for the log timestamp
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        timestamp = _fast_timestamp()
         
         # Extract request info
         method = request.method
         path = request.url.path
-        full_url = str(request.url)
         client_ip = request.client.host if request.client else "unknown"
-        user_agent = request.headers.get("user-agent", "unknown")
-        content_length = request.headers.get("content-length", "0")
-        content_type = request.headers.get("content-type", "unknown")
-        query_params = dict(request.query_params)
-        
-        # Prepare log data
-        log_data = {
-            "timestamp": timestamp,
-            "request_id": request_id,
-            "client_ip": client_ip,
-            "method": method,
-            "path": path,
-            "query_params": query_params,
-            "content_type": content_type,
-            "content_length": content_length,
-            "user_agent": user_agent[:100] if len(user_agent) > 100 else user_agent
-        }
+        # One pass over the raw ASGI headers (already lowercase) instead of a scan per lookup
+        headers = dict(request.scope["headers"])
+        user_agent = headers.get(b"user-agent", b"unknown").decode("latin-1")
+        content_length = headers.get(b"content-length", b"0").decode("latin-1")
+        content_type = headers.get(b"content-type", b"unknown").decode("latin-1")
+        # Parsed only when there is a query string; materialized as a dict only when logged
+        query_params = request.query_params if request.scope.get("query_string") else None
         
+        # Nothing is formatted unless INFO is enabled (LOG_LEVEL=WARNING skips all of it); banners are
+        # for a terminal, otherwise each request is logged as one JSON line on completion
+        log_enabled = logger.isEnabledFor(logging.INFO)
+        pretty_logs = log_enabled and REQUEST_LOG_PRETTY
+
         # Log request start with beautiful formatting
-        logger.info(f"┌{'─' * 60}")
-        logger.info(f"│ 🚀 REQUEST {request_id} - {timestamp}")
-        logger.info(f"│ {method} {path}")
-        logger.info(f"│ Client: {client_ip} | Size: {content_length}B")
-        if query_params:
-            logger.info(f"│ Query: {json.dumps(query_params)}")
-        logger.info(f"└{'─' * 60}")
+        # (one multi-line record per banner rather than one record per line)
+        if pretty_logs:
+            query_line = f"│ Query: {orjson.dumps(dict(query_params)).decode()}\n" if query_params else ""
+            self._log(
+                f"{_BANNER_TOP}\n"
+                f"│ 🚀 REQUEST {request_id} - {timestamp}\n"
+                f"│ {method} {path}\n"
+                f"│ Client: {client_ip} | Size: {content_length}B\n"
+                f"{query_line}"
+                f"{_BANNER_BOTTOM}"
+            )
         
         try:
             # Process request
             response: Response = await call_next(request)
             
             # Calculate processing time
-            process_time = time.time() - start_time
-            end_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+            process_time = loop.time() - start_time
+            end_timestamp = _fast_timestamp()
             
             # Get response info
             status_code = response.status_code
             response_size = response.headers.get("content-length", "unknown")
             
-            # Determine status emoji and color based on status code
-            if 200 <= status_code < 300:
-                status_emoji = "✅"
-                status_text = "SUCCESS"
-            elif 300 <= status_code < 400:
-                status_emoji = "⚠️"
-                status_text = "REDIRECT"
-            elif 400 <= status_code < 500:
-                status_emoji = "❌"
-                status_text = "CLIENT ERROR"
-            else:
-                status_emoji = "🔥"
-                status_text = "SERVER ERROR"
-            
-            # Add response data to log
-            log_data.update({
-                "status_code": status_code,
-                "response_size": response_size,
-                "process_time_ms": round(process_time * 1000, 2),
-                "end_timestamp": end_timestamp
-            })
-            
             # Log response with beautiful formatting
-            logger.info(f"┌{'─' * 60}")
-            logger.info(f"│ {status_emoji} RESPONSE {request_id} - {end_timestamp}")
-            logger.info(f"│ {status_code} {status_text} | {method} {path}")
-            logger.info(f"│ Processed in: {process_time:.3f}s | Size: {response_size}B")
-            logger.info(f"└{'─' * 60}")
+            if pretty_logs:
+                # Determine status emoji and label based on status code
+                status_emoji, status_text = _STATUS_LABELS[bisect.bisect_right(_STATUS_BOUNDS, status_code)]
+                self._log(
+                    f"{_BANNER_TOP}\n"
+                    f"│ {status_emoji} RESPONSE {request_id} - {end_timestamp}\n"
+                    f"│ {status_code} {status_text} | {method} {path}\n"
+                    f"│ Processed in: {process_time:.3f}s | Size: {response_size}B\n"
+                    f"{_BANNER_BOTTOM}"
+                )
+            elif log_enabled:
+                self._log(orjson.dumps({
+                    "timestamp": timestamp,
+                    "request_id": request_id,
+                    "client_ip": client_ip,
+                    "method": method,
+                    "path": path,
+                    "query_params": dict(query_params) if query_params else None,
+                    "content_type": content_type,
+                    "content_length": content_length,
+                    # Slicing past the end returns the same string object, so no length check is needed
+                    "user_agent": user_agent[:100],
+                    "status_code": status_code,
+                    "response_size": response_size,
+                    "process_time_ms": round(process_time * 1000, 2),
+                    "end_timestamp": end_timestamp
+                }).decode())
             
             # Add headers to response
             response.headers[self.request_id_header] = request_id
@@ -117,15 +218,34 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
             return response
             
         except Exception as e:
-            # Log exception
-            logger.error(f"┌{'─' * 60}")
-            logger.error(f"│ 🔥 EXCEPTION {request_id}")
-            logger.error(f"│ {method} {path}")
-            logger.error(f"│ Error: {str(e)}")
-            logger.error(f"└{'─' * 60}", exc_info=True)
+            # CancelledError is a BaseException and propagates untouched; HTTPExceptions never reach
+            # here because FastAPI's exception middleware sits inside call_next and renders them
+            if REQUEST_LOG_PRETTY and logger.isEnabledFor(logging.ERROR):
+                self._err(
+                    f"{_BANNER_TOP}\n"
+                    f"│ 🔥 EXCEPTION {request_id}\n"
+                    f"│ {method} {path}\n"
+                    f"│ Error: {str(e)}\n"
+                    f"{_BANNER_BOTTOM}",
+                    exc_info=True
+                )
+            elif logger.isEnabledFor(logging.ERROR):
+                # Same one-line record as successful requests; the traceback travels as a field
+                self._err(orjson.dumps({
+                    "timestamp": timestamp,
+                    "request_id": request_id,
+                    "client_ip": client_ip,
+                    "method": method,
+                    "path": path,
+                    "status_code": 500,
+                    "error": str(e),
+                    "traceback": traceback.format_exc(),
+                    "process_time_ms": round((loop.time() - start_time) * 1000, 2),
+                    "end_timestamp": _fast_timestamp()
+                }).decode())
             
             # Return error response
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={"detail": "Internal server error", "request_id": request_id}
             )
\ No newline at end of file
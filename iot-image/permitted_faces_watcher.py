@@ -0,0 +1,108 @@
+# permitted_faces_watcher.py
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import FileSystemEventHandler, Observer, PERMITTED_FACES_DIR, watchdog_available
+from data_store import PERMITTED_IMAGE_SUFFIXES, data_store
+
+logger = logging.getLogger(__name__)
+
+# Quiet period after the last event for a file before it is (re-)encoded; uploads arrive as many write events
+SETTLE_SECONDS = 0.5
+
+
+class PermittedFacesWatcher(FileSystemEventHandler if watchdog_available else object):
+    """
+    Watches PERMITTED_FACES_DIR and applies each added, changed, moved or deleted image to the
+    data store on its own, so the gallery stays current without rescanning the whole directory.
+    """
+
+    def __init__(self, store, directory: Path = PERMITTED_FACES_DIR):
+        super().__init__()
+        self.data_store = store
+        self.directory = directory
+        self.observer: Optional[Observer] = None
+        self.pending: Dict[str, threading.Timer] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self.observer is not None and self.observer.is_alive()
+
+    def start(self) -> bool:
+        if not watchdog_available:
+            logger.info("watchdog not installed; permitted faces are synced by the upload endpoint only.")
+            return False
+        if self.is_running:
+            return True
+        self.observer = Observer()
+        self.observer.schedule(self, str(self.directory), recursive=False)
+        self.observer.daemon = True
+        self.observer.start()
+        logger.info("Watching %s for permitted face changes.", self.directory)
+        return True
+
+    def stop(self):
+        if self.observer is None:
+            return
+        self.observer.stop()
+        self.observer.join()
+        self.observer = None
+        with self.lock:
+            for timer in self.pending.values():
+                timer.cancel()
+            self.pending.clear()
+        logger.info("Permitted faces watcher stopped.")
+
+    def _schedule(self, path: str):
+        filename = os.path.basename(path)
+        # Only gallery images; skips the encoding cache and its temp files
+        if filename.startswith(".") or filename.rpartition(".")[2].lower() not in PERMITTED_IMAGE_SUFFIXES:
+            return
+        with self.lock:
+            timer = self.pending.pop(filename, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(SETTLE_SECONDS, self._submit_sync, args=(filename,))
+            timer.daemon = True
+            self.pending[filename] = timer
+            timer.start()
+
+    def _submit_sync(self, filename: str):
+        with self.lock:
+            self.pending.pop(filename, None)
+        # Encodes run on the identification thread, which owns the face models and the pinned CUDA device
+        try:
+            self.data_store.identification_executor.submit(self._sync, filename)
+        except RuntimeError:
+            pass  # Executor already shut down
+
+    def _sync(self, filename: str):
+        try:
+            self.data_store.sync_permitted_face(self.directory / filename)
+        except Exception as e:
+            logger.error("Failed to sync permitted face %s: %s", filename, e, exc_info=True)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._schedule(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._schedule(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self._schedule(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._schedule(event.src_path)
+            self._schedule(event.dest_path)
+
+
+# Shared watcher for the app's data store
+permitted_faces_watcher = PermittedFacesWatcher(data_store)
@@ -0,0 +1,113 @@
+# recognition_batcher.py
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class RecognitionBatcher:
+    """
+    Coalesces concurrent recognition requests into batches.
+    Requests arriving within `window_ms` of each other (up to `max_batch_size`)
+    are handed to `process_batch` together in a single worker-thread call.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, window_ms: float = 10.0,
+                 executor: Optional[Executor] = None):
+        self.process_batch = process_batch
+        # Dedicated executor for batches (e.g. a single GPU thread); defaults to the shared threadpool
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker_task: Optional[asyncio.Task] = None
+        # Batch being collected or processed, so stop() can fail its futures if it is cut short
+        self.in_flight: List[Tuple[Any, asyncio.Future]] = []
+
+    @property
+    def is_running(self) -> bool:
+        return self.worker_task is not None and not self.worker_task.done()
+
+    def start(self):
+        if self.is_running:
+            return
+        self.queue = asyncio.Queue()
+        self.worker_task = asyncio.create_task(self._run())
+        logger.info(f"Recognition batcher started (batch size {self.max_batch_size}, window {self.window * 1000:.0f}ms)")
+
+    async def stop(self):
+        if not self.is_running:
+            return
+        self.worker_task.cancel()
+        try:
+            await self.worker_task
+        except asyncio.CancelledError:
+            pass
+        self.worker_task = None
+
+        # Fail whatever was cut short or still queued, so no caller waits forever
+        pending = self.in_flight
+        self.in_flight = []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        # Later submits process inline
+        self.queue = None
+        error = RuntimeError("Recognition batcher stopped.")
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+        logger.info("Recognition batcher stopped.")
+
+    async def _process(self, items: List[Any]) -> List[Any]:
+        if self.executor is not None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.process_batch, items)
+        return await run_in_threadpool(self.process_batch, items)
+
+    async def submit(self, item: Any) -> Any:
+        if not self.is_running:
+            # No background worker (e.g. outside the app lifespan): process on its own
+            results = await self._process([item])
+            return results[0]
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self.queue.get()]
+        self.in_flight = batch
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            items = [item for item, _ in batch]
+            try:
+                results = await self._process(items)
+            except Exception as e:
+                logger.error(f"Recognition batch of {len(items)} failed: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self.in_flight = []
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self.in_flight = []
@@ -1,9 +1,10 @@
 # ssh_tunnel.py
 import logging
 import os
+import select
 import socket
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
@@ -11,6 +12,19 @@ import paramiko
 
 logger = logging.getLogger(__name__)
 
+# Tunneled connections are relayed by one select loop each, on a shared pool of threads
+FORWARD_BUFFER_SIZE = 64 * 1024
+FORWARD_SELECT_TIMEOUT = 30.0  # Seconds between checks that an idle channel is still open
+# Each relay holds its thread for the connection's lifetime (keep-alive, WebSockets), so connections
+# beyond this are refused immediately rather than queued behind busy workers
+TUNNEL_MAX_CONNECTIONS = 64
+_forward_executor = ThreadPoolExecutor(max_workers=TUNNEL_MAX_CONNECTIONS, thread_name_prefix="tunnel-forward")
+_forward_slots = threading.BoundedSemaphore(TUNNEL_MAX_CONNECTIONS)
+
+TUNNEL_KEEPALIVE = 30  # Seconds between SSH keepalives; a dead link ends the transport within a few of these
+TUNNEL_RECONNECT_DELAY = 15.0  # Seconds to wait after a failed connection attempt
+TUNNEL_WATCH_TIMEOUT = 300.0  # Upper bound on a single wait for the transport to exit
+
 class SSHTunnel:
     """SSH Reverse Tunnel implementation using paramiko"""
     
@@ -38,6 +52,7 @@ class SSHTunnel:
         self.transport = None
         self.is_active = False
         self.should_reconnect = True
+        self.stop_event = threading.Event()
         self.tunnel_thread = None
         
         if not self.public_vps_ip:
@@ -47,13 +62,32 @@ class SSHTunnel:
         if not path: return path
         return str(Path(path).expanduser().resolve())
     
+    def _key_classes_for(self, header: str) -> list:
+        """Key classes able to parse a private key file with this first line, most likely first."""
+        if "OPENSSH PRIVATE KEY" in header:
+            # The OpenSSH container is used for every key type; ed25519 keys are only ever stored in it
+            return [paramiko.Ed25519Key, paramiko.RSAKey, paramiko.ECDSAKey]
+        if "RSA PRIVATE KEY" in header:
+            return [paramiko.RSAKey]
+        if "EC PRIVATE KEY" in header:
+            return [paramiko.ECDSAKey]
+        if "DSA PRIVATE KEY" in header:
+            return [paramiko.DSSKey]
+        return [paramiko.RSAKey, paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.DSSKey]
+
     def _get_ssh_key(self) -> Optional[paramiko.PKey]:
         if not self.private_key_path: return None
         key_path = self._resolve_path(self.private_key_path)
         try:
-            for key_class in [paramiko.RSAKey, paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.DSSKey]:
+            with open(key_path, "r", encoding="ascii", errors="replace") as f:
+                header = f.readline()
+            for key_class in self._key_classes_for(header):
                 try:
                     return key_class.from_private_key_file(key_path, password=self.passphrase)
+                except paramiko.PasswordRequiredException:
+                    # Another key class would fail the same way; no point probing further
+                    logger.error(f"Private key {key_path} is encrypted; set SSH_PASSPHRASE")
+                    return None
                 except Exception:
                     continue
             logger.error(f"Unable to load private key from {key_path}")
@@ -62,29 +96,50 @@ class SSHTunnel:
             logger.error(f"Error loading private key: {e}")
             return None
 
-    def _handle_tunnel_connection(self, channel, origin, server):
+    def _forward(self, channel, origin):
+        """Relay data both ways between a tunnel channel and the local server until either side closes."""
+        local_socket = None
         try:
-            local_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            local_socket.connect(('127.0.0.1', self.private_server_port))
-
-            def forward(src, dest, direction):
-                try:
-                    while True:
-                        data = src.recv(1024)
-                        if not data: break
-                        dest.sendall(data)
-                except (socket.error, OSError):
-                    pass  # Connection closed, ignore
-                finally:
-                    try:
-                        src.close()
-                        dest.close()
-                    except:
-                        pass
+            local_socket = socket.create_connection(('127.0.0.1', self.private_server_port))
+            sockets = [channel, local_socket]
+            # Local reads land in one reused buffer; paramiko channels only offer recv(), which returns bytes
+            buffer = bytearray(FORWARD_BUFFER_SIZE)
+            view = memoryview(buffer)
+            while True:
+                readable, _, _ = select.select(sockets, [], [], FORWARD_SELECT_TIMEOUT)
+                if not readable:
+                    if channel.closed:
+                        break
+                    continue
+                if channel in readable:
+                    data = channel.recv(FORWARD_BUFFER_SIZE)
+                    if not data:
+                        break
+                    local_socket.sendall(data)
+                if local_socket in readable:
+                    count = local_socket.recv_into(view)
+                    if not count:
+                        break
+                    channel.sendall(view[:count])
+        except (socket.error, OSError) as e:
+            if local_socket is None:
+                logger.error(f"Error handling tunnel connection from {origin}: {e}")
+        finally:
+            channel.close()
+            if local_socket is not None:
+                local_socket.close()
+            _forward_slots.release()
 
-            threading.Thread(target=forward, args=(channel, local_socket, "fwd"), daemon=True).start()
-            threading.Thread(target=forward, args=(local_socket, channel, "rev"), daemon=True).start()
-        except Exception as e:
+    def _handle_tunnel_connection(self, channel, origin, server):
+        # Called on paramiko's transport thread, so the relay is handed off rather than run here
+        if not _forward_slots.acquire(blocking=False):
+            logger.warning(f"Refusing tunnel connection from {origin}: {TUNNEL_MAX_CONNECTIONS} connections already open")
+            channel.close()
+            return
+        try:
+            _forward_executor.submit(self._forward, channel, origin)
+        except RuntimeError as e:
+            _forward_slots.release()
             logger.error(f"Error handling tunnel connection from {origin}: {e}")
             channel.close()
 
@@ -116,7 +171,7 @@ class SSHTunnel:
 
             self.ssh_client.connect(**connect_kwargs)
             self.transport = self.ssh_client.get_transport()
-            self.transport.set_keepalive(60)
+            self.transport.set_keepalive(TUNNEL_KEEPALIVE)
             
             logger.info("SSH connection established. Setting up reverse tunnel...")
             self.transport.request_port_forward('', self.public_port, handler=self._handle_tunnel_connection)
@@ -133,6 +188,7 @@ class SSHTunnel:
 
     def disconnect(self):
         self.should_reconnect = False
+        self.stop_event.set()
         self.is_active = False
         if self.transport and self.transport.is_active():
             self.transport.cancel_port_forward('', self.public_port)
@@ -143,11 +199,18 @@ class SSHTunnel:
     def start(self):
         def tunnel_worker():
             while self.should_reconnect:
-                if not (self.transport and self.transport.is_active()):
-                    self.is_active = False
-                    logger.info("Tunnel is down, attempting to reconnect...")
-                    self.connect()
-                time.sleep(15) # Check connection status every 15 seconds
+                transport = self.transport
+                if transport and transport.is_active():
+                    # The transport is a thread that exits when the connection drops (keepalives detect
+                    # dead links), so block on it instead of polling
+                    transport.join(TUNNEL_WATCH_TIMEOUT)
+                    continue
+                if not self.should_reconnect:
+                    break
+                self.is_active = False
+                logger.info("Tunnel is down, attempting to reconnect...")
+                if not self.connect():
+                    self.stop_event.wait(TUNNEL_RECONNECT_DELAY)
         
         self.tunnel_thread = threading.Thread(target=tunnel_worker, daemon=True)
         self.tunnel_thread.start()
@@ -29,6 +29,17 @@ if [ ! -f ".env" ]; then
     echo "Warning: .env file not found. Using default configuration."
 fi
 
+# Optional: let several uvicorn workers (WORKERS>1) share the GPU concurrently through CUDA MPS
+# Enable with: CUDA_MPS=true ./start_service.sh
+if [ "${CUDA_MPS:-false}" = "true" ]; then
+    if command -v nvidia-cuda-mps-control >/dev/null 2>&1; then
+        echo "Starting CUDA MPS control daemon..."
+        nvidia-cuda-mps-control -d || echo "Warning: could not start the CUDA MPS daemon (already running?)"
+    else
+        echo "Warning: CUDA_MPS=true but nvidia-cuda-mps-control was not found."
+    fi
+fi
+
 # Start the service
 echo "Starting Python GPU service..."
 echo "Service will be available at: http://localhost:9001"